@@ -1,32 +1,55 @@
 import argparse
-import random
+import hashlib
+import json
+import os
+import pickle
 from argparse import Namespace
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List
 
 import uvicorn
 import yaml
+from pydantic import TypeAdapter
 
 from app import create_app
-from common import call_endpoint, get_pod_infos
+from common import (
+    MAX_ACTION_CONCURRENCY,
+    action_batches,
+    call_endpoint,
+    get_pod_infos,
+    group_pods_by_target,
+    select_action_pods,
+)
 from configs import ConfigAction, ConfigEndpoint, ConfigRequest, ConfigTarget
 from schemas import TargetPodInfo
 from utils import setup_logger
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
 
+# Prefer the libyaml-backed loader when PyYAML was built with it.
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-def assert_unique_attr(objects: List[object], attribute: str):
-    names = [getattr(endpoint, attribute) for endpoint in objects]
-    duplicates = set()
-    seen = []
+CONFIG_CACHE_DIR = Path.home() / ".cache" / "pod-api-requester"
+"""Where parsed configs are cached between runs. See `load_configs`."""
+
+CONFIG_CACHE_VERSION = 2
+"""Part of every config cache key. Changes to the fields of the config classes are already
+covered by `config_schema_key`. Bump this for other changes to how configs are pickled."""
 
-    for name in names:
-        if any(name == item for item in seen):
-            duplicates.add(name)
-        else:
-            seen.append(name)
+# Each config category is validated in one pass. Requests and actions hold already-validated
+# endpoints and targets, which pydantic accepts without validating them again.
+TARGETS_ADAPTER = TypeAdapter(List[ConfigTarget])
+ENDPOINTS_ADAPTER = TypeAdapter(List[ConfigEndpoint])
+REQUESTS_ADAPTER = TypeAdapter(List[ConfigRequest])
+ACTIONS_ADAPTER = TypeAdapter(List[ConfigAction])
+
+
+def assert_unique_attr(objects: List[object], attribute: str):
+    counts = Counter(getattr(obj, attribute) for obj in objects)
+    duplicates = {name for name, count in counts.items() if count > 1}
 
     assert not duplicates, (
         f"At least one object has the same attribute as another. "
@@ -37,22 +60,20 @@ def assert_unique_attr(objects: List[object], attribute: str):
 
 
 def parse_config(config: Dict[str, List[object]]) -> Dict[str, Dict[str, object]]:
-    targets = [ConfigTarget.model_validate(targ) for targ in config.get("targets", [])]
+    targets = TARGETS_ADAPTER.validate_python(config.get("targets", []))
     targets_dict = {target.name: target for target in targets}
     assert_unique_attr(targets, "name")
 
-    endpoints = [ConfigEndpoint.model_validate(endpoint) for endpoint in config["endpoints"]]
+    endpoints = ENDPOINTS_ADAPTER.validate_python(config["endpoints"])
     endpoints_dict = {endpoint.name: endpoint for endpoint in endpoints}
     assert_unique_attr(endpoints, "name")
 
-    requests = []
     for request_dict in config["requests"]:
         request_dict["endpoint"] = endpoints_dict[request_dict["endpoint"]]
-        requests.append(ConfigRequest.model_validate(request_dict))
+    requests = REQUESTS_ADAPTER.validate_python(config["requests"])
     requests_dict = {request.name: request for request in requests}
     assert_unique_attr(requests, "name")
 
-    actions: List[ConfigAction] = []
     for action in config["actions"]:
         try:
             action["requests"] = [requests_dict[req] for req in action["requests"]]
@@ -66,7 +87,7 @@ def parse_config(config: Dict[str, List[object]]) -> Dict[str, Dict[str, object]
             raise ValueError(
                 f"Action contains unknown target. action: `{action}` targets: `{targets_dict}`"
             ) from e
-        actions.append(ConfigAction.model_validate(action))
+    actions = ACTIONS_ADAPTER.validate_python(config["actions"])
     actions_dict = {action.name: action for action in actions}
     assert_unique_attr(actions, "name")
 
@@ -78,52 +99,93 @@ def parse_config(config: Dict[str, List[object]]) -> Dict[str, Dict[str, object]
     }
 
 
+@lru_cache(maxsize=1)
+def config_schema_key() -> str:
+    """Digest of the JSON schemas of the config classes.
+    Changes whenever a field is added, removed or changed, so older pickles are not loaded."""
+    schemas = [
+        config_class.model_json_schema()
+        for config_class in (ConfigTarget, ConfigEndpoint, ConfigRequest, ConfigAction)
+    ]
+    return hashlib.blake2b(json.dumps(schemas, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def config_cache_path(config_files: List[str]) -> Path:
+    """Location of the cached parse of `config_files`.
+    The key changes whenever any of the files is modified, the files are given in another
+    order, or the config classes change."""
+    key_parts = [str(CONFIG_CACHE_VERSION), config_schema_key()]
+    for config_file in config_files:
+        stat = os.stat(config_file)
+        key_parts.append(f"{Path(config_file).resolve()}:{stat.st_mtime_ns}:{stat.st_size}")
+    key = hashlib.blake2b("|".join(key_parts).encode(), digest_size=16).hexdigest()
+    return CONFIG_CACHE_DIR / f"{key}.pkl"
+
+
 def load_configs(config_files: List[str]) -> Dict[str, Dict[str, object]]:
+    cache_path = config_cache_path(config_files)
+    try:
+        with open(cache_path, "rb") as file:
+            config = pickle.load(file)
+        logger.info(f"Loaded configs from cache. configs: {config_files} cache: {cache_path}")
+        return config
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(
+            f"Ignoring unreadable config cache. cache: `{cache_path}` exception: `{e!r}`"
+        )
+
+    config = read_configs(config_files)
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as file:
+            pickle.dump(config, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Failed to cache parsed configs. cache: `{cache_path}` exception: `{e!r}`")
+
+    return config
+
+
+def read_configs(config_files: List[str]) -> Dict[str, Dict[str, object]]:
     logger.info(f"Loading configs: {config_files}")
     full_config = defaultdict(list)
     for config_file in config_files:
-        with open(config_file, "r") as file:
-            config = yaml.safe_load(file)
-            for key, value in config.items():
-                full_config[key].extend(value)
+        # Parsed per file, so YAML errors point at the file and line they come from.
+        with open(config_file, "rb") as file:
+            for config in yaml.load_all(file, Loader=YamlLoader):
+                # Empty documents, such as a file that is only `---`.
+                if config is None:
+                    continue
+                for key, value in config.items():
+                    full_config[key].extend(value)
     return parse_config(full_config)
 
 
 def do_action(
     action: ConfigAction,
-    pods: List[TargetPodInfo],
+    pods_by_target: Dict[str, List[TargetPodInfo]],
 ):
-    target_names = [target.name for target in action.targets]
-    possible_pods = [pod for pod in pods if pod.config_target.name in target_names]
-
-    if action.order == "random":
-        random.shuffle(possible_pods)
-    elif action.order == "ascending":
-        possible_pods.sort(key=lambda pod: pod.pod_name)
-    elif action.order == "descending":
-        possible_pods.sort(key=lambda pod: pod.pod_name, reverse=True)
-    else:
-        raise ValueError(f"Unknown order for action: {action.order}")
-
-    pods = []
-    count = len(possible_pods) if action.pod_count == "all" else action.pod_count
-    index = action.pod_start_index
-    for _ in range(count):
-        pods.append(possible_pods[index])
-        index = (index + 1) % len(possible_pods)
-
-    if action.loop_order == "foreach_pod_make_all_requests":
-        for pod in pods:
-            for request in action.requests:
-                # time.sleep(delay_between_requests) TODO
-                call_endpoint(request, pod)
-    elif action.loop_order == "foreach_request_target_each_pod":
-        for request in action.requests:
-            # TODO: ensure time between requests has elapsed
-            for pod in pods:
-                call_endpoint(request, pod)
-    else:
-        raise ValueError(f"Unknown loop_order for action: {action}")
+    pods = select_action_pods(action, pods_by_target)
+    if not pods:
+        logger.info(f"No pods to make requests to. action: `{action.name}`")
+        return
+
+    def make_requests(pod: TargetPodInfo, requests: List[ConfigRequest]):
+        for request in requests:
+            # time.sleep(delay_between_requests) TODO
+            call_endpoint(request.endpoint, pod)
+
+    # Requests to different pods are independent, so they are made concurrently.
+    with ThreadPoolExecutor(max_workers=min(MAX_ACTION_CONCURRENCY, len(pods))) as executor:
+        # Each batch finishes before the next one starts.
+        for batch in action_batches(action, pods):
+            futures = [executor.submit(make_requests, pod, requests) for pod, requests in batch]
+            for future in as_completed(futures):
+                future.result()
 
 
 def main(args: Namespace):
@@ -132,11 +194,21 @@ def main(args: Namespace):
     logger.debug(f"Loaded config. Available endpoints: {available_endpoints}")
     if args.mode == "server":
         app = create_app(config)
-        uvicorn.run(app, host="0.0.0.0", port=args.port, log_config=None)
+        # Single worker: the app holds in-process state (config, informers, HTTP client pool).
+        uvicorn.run(
+            app,
+            host="0.0.0.0",
+            port=args.port,
+            log_config=None,
+            loop="uvloop",
+            http="httptools",
+            interface="asgi3",
+        )
     else:
-        pods_info = get_pod_infos(config["targets"])
-        for action in config["actions"]:
-            do_action(action, pods_info)
+        pods_info = get_pod_infos(list(config["targets"].values()))
+        pods_by_target = group_pods_by_target(pods_info)
+        for action in config["actions"].values():
+            do_action(action, pods_by_target)
 
 
 def mode_type(value):
@@ -1,26 +1,66 @@
-from collections import defaultdict
+import traceback
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
+from kube_client import Informer, core_v1, default_namespace, service_informers
 from routers.registry import build_routers
-from utils import setup_logger
+from schemas import NotFoundError
+from utils import HTTP_TIMEOUT, setup_logger
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for the whole app, so requests to pods reuse keep-alive connections.
+    app.state.http_client = httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    )
+    app.state.pod_informer = Informer(core_v1.list_namespaced_pod, app.state.namespace)
+    app.state.service_informer = Informer(core_v1.list_namespaced_service, app.state.namespace)
+    service_informers[app.state.namespace] = app.state.service_informer
+    app.state.pod_informer.start()
+    app.state.service_informer.start()
+    try:
+        yield
+    finally:
+        service_informers.pop(app.state.namespace, None)
+        app.state.service_informer.stop()
+        app.state.pod_informer.stop()
+        await app.state.http_client.aclose()
+
+
+async def not_found_handler(request: Request, exc: NotFoundError) -> JSONResponse:
+    """Report a lookup miss, such as an unknown target name, as a 404."""
+    logger.info("Not found. path: `%s` exception: `%r`", request.url.path, exc)
+    return JSONResponse(status_code=404, content={"detail": f"{exc!r}"})
+
+
+async def unhandled_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+    """Report any other error a route didn't handle as a 500, with the traceback as detail.
+    `HTTPException`s are still handled by FastAPI itself.
+
+    Not logged here: the server error middleware re-raises the exception after this
+    returns, and uvicorn logs it with its traceback."""
+    message = f"{exc!r}\n{''.join(traceback.format_exception(exc))}"
+    return JSONResponse(status_code=500, content={"detail": message})
 
 
 def create_app(config) -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+    app.add_exception_handler(NotFoundError, not_found_handler)
+    app.add_exception_handler(Exception, unhandled_exception_handler)
 
-    app.state.namespace = (
-        open("/var/run/secrets/kubernetes.io/serviceaccount/namespace").read().strip() or "default"
-    )
+    app.state.namespace = default_namespace()
 
     async def get_config() -> dict:
         logger.debug(f"get_config: {config}")
         return config
 
-    app.state.cache = defaultdict(dict)
-
     for router in build_routers(get_config):
         app.include_router(router)
 
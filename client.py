@@ -1,5 +1,6 @@
 import asyncio
 import json
+from functools import lru_cache
 from typing import Literal, Optional
 
 import requests
@@ -8,7 +9,13 @@ from pydantic import NonNegativeInt
 
 from utils import setup_logger
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_core_v1() -> client.CoreV1Api:
+    """The CoreV1Api shared by all requests. Created on first use, after the kube config is loaded."""
+    return client.CoreV1Api()
 
 
 async def main():
@@ -73,7 +80,7 @@ async def pod_api_request(
     *,
     publisher_pod: str | NonNegativeInt = 0,
 ) -> dict:
-    v1 = client.CoreV1Api()
+    v1 = get_core_v1()
 
     try:
         pods = v1.list_namespaced_pod(namespace=namespace, label_selector=f"app={app}")
@@ -1,100 +1,279 @@
+import asyncio
+import random
 import traceback
 from collections import defaultdict
-from typing import Iterable, List, Optional
+from itertools import chain, cycle, islice
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import httpx
+import orjson
 import requests
 from kubernetes.client.models.v1_pod import V1Pod
+from requests.adapters import HTTPAdapter
 
-from configs import ConfigEndpoint, ConfigRequest, ConfigTarget
-from kube_client import core_v1
+from configs import ConfigAction, ConfigEndpoint, ConfigRequest, ConfigTarget
+from kube_client import Informer, core_v1, default_namespace, service_selector
 from schemas import TargetPodInfo
-from utils import paged_request, setup_logger
+from utils import paged_request, paged_request_async, setup_logger
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
 
-CACHE_ALL_KEY = "*"
+MAX_ACTION_CONCURRENCY = 32
+"""Upper bound on concurrent requests made while performing an action."""
+
+# Shared by all synchronous requests to pods so keep-alive connections are reused.
+_session = requests.Session()
+for _prefix in ("http://", "https://"):
+    _session.mount(_prefix, HTTPAdapter(pool_connections=64, pool_maxsize=128, max_retries=0))
 
 
 def do_request(request: ConfigRequest, pod_info: TargetPodInfo):
     raise NotImplementedError()
 
 
+def _request_data(endpoint: ConfigEndpoint, pod_info: TargetPodInfo) -> dict:
+    request_data = {
+        "params": endpoint.params,
+        "headers": endpoint.headers,
+        "url": endpoint.format_url(
+            node=pod_info.pod.status.pod_ip, port=pod_info.config_target.port
+        ),
+        "pod": f"{pod_info.pod.metadata.name}",
+    }
+    if endpoint.paged:
+        request_data["extract_keys"] = endpoint.extract_path
+    return request_data
+
+
+def _json_body(params: dict, headers: dict) -> Tuple[bytes, dict]:
+    """Serialize `params` as a JSON request body.
+    Adds a JSON `Content-Type` header, unless `headers` already has one."""
+    if not any(key.lower() == "content-type" for key in headers):
+        headers = {**headers, "Content-Type": "application/json"}
+    return orjson.dumps(params, option=orjson.OPT_NON_STR_KEYS), headers
+
+
 def call_endpoint(endpoint: ConfigEndpoint, pod_info: TargetPodInfo) -> dict:
     result_data = {"request": {"configEndpoint": endpoint}}
-    request_data = {"params": endpoint.params, "headers": endpoint.headers}
 
     try:
-        request_data["url"] = endpoint.url.format(
-            node=pod_info.pod.status.pod_ip, port=pod_info.config_target.port
-        )
-        request_data["pod"] = f"{pod_info.pod.metadata.name}"
-        logger.info(f"request_data: {request_data}")
+        request_data = _request_data(endpoint, pod_info)
+        logger.info("request_data: %s", request_data)
 
         if endpoint.paged:
             if endpoint.type != "GET":
                 raise NotImplementedError("Paged requests only implemented for GET requests.")
-            result = paged_request(request=request_data, max_attempts=1, page_request_delay=0)
+            paged = paged_request(request=request_data, max_attempts=1, page_request_delay=0)
+            response = paged["response"]
         else:
             if endpoint.type == "POST":
-                result = requests.post(
+                body, headers = _json_body(request_data["params"], request_data["headers"])
+                result = _session.post(request_data["url"], data=body, headers=headers)
+            elif endpoint.type == "GET":
+                result = _session.get(
                     request_data["url"],
-                    json=request_data["params"],
+                    params=request_data["params"],
                     headers=request_data["headers"],
                 )
+            else:
+                raise AttributeError(f"Unknown request type. request: `{endpoint}`")
+            response = {
+                "status_code": result.status_code,
+                "text": result.text,
+            }
+
+        result_data["request"].update(request_data)
+        result_data["response"] = response
+        logger.info(
+            "Response from pod. pod: `%s` status_code: `%s`",
+            request_data["pod"],
+            response.get("status_code", response.get("statusCodes")),
+        )
+    except Exception as e:
+        error = traceback.format_exc()
+        logger.error(
+            "Exception attempting API request. endpoint: `%s`, exception: `%s`, error: `%s`",
+            endpoint,
+            e,
+            error,
+        )
+        result_data["exception"] = error
+
+    # The full result repeats the endpoint and the response body, so it is only logged for debugging.
+    logger.debug("result_data: %s", result_data)
+    return result_data
+
+
+async def call_endpoint_async(
+    endpoint: ConfigEndpoint, pod_info: TargetPodInfo, client: httpx.AsyncClient
+) -> dict:
+    """Same as `call_endpoint`, but awaits the request on a shared `httpx.AsyncClient`
+    so concurrent API calls don't block the event loop."""
+    result_data = {"request": {"configEndpoint": endpoint}}
+
+    try:
+        request_data = _request_data(endpoint, pod_info)
+        logger.info("request_data: %s", request_data)
+
+        if endpoint.paged:
+            if endpoint.type != "GET":
+                raise NotImplementedError("Paged requests only implemented for GET requests.")
+            paged = await paged_request_async(
+                client, request=request_data, max_attempts=1, page_request_delay=0
+            )
+            response = paged["response"]
+        else:
+            if endpoint.type == "POST":
+                body, headers = _json_body(request_data["params"], request_data["headers"])
+                result = await client.post(request_data["url"], content=body, headers=headers)
             elif endpoint.type == "GET":
-                result = requests.get(
+                result = await client.get(
                     request_data["url"],
-                    json=request_data["params"],
+                    params=request_data["params"],
                     headers=request_data["headers"],
                 )
             else:
                 raise AttributeError(f"Unknown request type. request: `{endpoint}`")
+            response = {
+                "status_code": result.status_code,
+                "text": result.text,
+            }
 
         result_data["request"].update(request_data)
-        result_data["response"] = {
-            "status_code": result.status_code,
-            "text": result.text,
-        }
+        result_data["response"] = response
+        logger.info(
+            "Response from pod. pod: `%s` status_code: `%s`",
+            request_data["pod"],
+            response.get("status_code", response.get("statusCodes")),
+        )
     except Exception as e:
         error = traceback.format_exc()
         logger.error(
-            f"Exception attempting API request. endpoint: `{endpoint}`, exception: `{e}`, error: `{error}`"
+            "Exception attempting API request. endpoint: `%s`, exception: `%s`, error: `%s`",
+            endpoint,
+            e,
+            error,
         )
         result_data["exception"] = error
 
-    logger.info(result_data)
+    # The full result repeats the endpoint and the response body, so it is only logged for debugging.
+    logger.debug("result_data: %s", result_data)
     return result_data
 
 
+def group_pods_by_target(pods_info: Iterable[TargetPodInfo]) -> Dict[str, List[TargetPodInfo]]:
+    pods_by_target = defaultdict(list)
+    for pod_info in pods_info:
+        pods_by_target[pod_info.config_target.name].append(pod_info)
+    return pods_by_target
+
+
+def select_action_pods(
+    action: ConfigAction, pods_by_target: Dict[str, List[TargetPodInfo]]
+) -> List[TargetPodInfo]:
+    """Apply the action's `order`, `pod_start_index` and `pod_count` to the pods of its targets."""
+    # A target listed twice in an action still only contributes its pods once.
+    target_names = dict.fromkeys(target.name for target in action.targets)
+    possible_pods = list(chain.from_iterable(pods_by_target[name] for name in target_names))
+
+    if action.order == "random":
+        random.shuffle(possible_pods)
+    elif action.order == "ascending":
+        possible_pods.sort(key=lambda pod: pod.pod_name)
+    elif action.order == "descending":
+        possible_pods.sort(key=lambda pod: pod.pod_name, reverse=True)
+    else:
+        raise ValueError(f"Unknown order for action: {action.order}")
+
+    count = len(possible_pods) if action.pod_count == "all" else action.pod_count
+    start = action.pod_start_index
+    return list(islice(cycle(possible_pods), start, start + count))
+
+
+def action_batches(
+    action: ConfigAction, pods: List[TargetPodInfo]
+) -> List[List[Tuple[TargetPodInfo, List[ConfigRequest]]]]:
+    """Split the action's work into batches of `(pod, requests)` according to `loop_order`.
+
+    Within a batch, each pod's requests are made in order, and different pods are independent.
+    A batch must finish before the next one starts."""
+    if action.loop_order == "foreach_pod_make_all_requests":
+        return [[(pod, action.requests) for pod in pods]]
+    elif action.loop_order == "foreach_request_target_each_pod":
+        # TODO: ensure time between requests has elapsed
+        return [[(pod, [request]) for pod in pods] for request in action.requests]
+    else:
+        raise ValueError(f"Unknown loop_order for action: {action}")
+
+
+async def do_action_async(
+    action: ConfigAction, pods: List[TargetPodInfo], client: httpx.AsyncClient
+) -> List[dict]:
+    """Make the action's requests to `pods`, with up to `MAX_ACTION_CONCURRENCY` in flight."""
+    semaphore = asyncio.Semaphore(MAX_ACTION_CONCURRENCY)
+
+    async def make_requests(pod: TargetPodInfo, requests: List[ConfigRequest]) -> List[dict]:
+        results = []
+        for request in requests:
+            async with semaphore:
+                results.append(await call_endpoint_async(request.endpoint, pod, client))
+        return results
+
+    results = []
+    for batch in action_batches(action, pods):
+        batch_results = await asyncio.gather(
+            *(make_requests(pod, requests) for pod, requests in batch)
+        )
+        results.extend(chain.from_iterable(batch_results))
+    return results
+
+
 def get_pod_infos(
     targets: List[ConfigTarget],
-    namespace: str,
+    namespace: Optional[str] = None,
     *,
-    cache: Optional[defaultdict] = None,
+    informer: Optional[Informer] = None,
+    limit: Optional[int] = None,
 ) -> List[TargetPodInfo]:
-    pods_info: List[TargetPodInfo] = []
-    for target in targets:
-        svc_key = target.service or CACHE_ALL_KEY
-        try:
-            pods = cache[namespace][svc_key]
-        except (TypeError, KeyError):
-            pods = get_pods(service=target.service, namespace=namespace)
-            if cache is not None:
-                cache[namespace][svc_key] = pods
-        for pod in filter_pods(target, pods, namespace):
-            pods_info.append(TargetPodInfo(config_target=target, pod=pod))
-    return pods_info
-
-
-def get_pods(*, namespace: str, service: Optional[str]) -> List[str]:
+    """Find the pods matching each target.
+
+    :param informer: Pod informer for `namespace`. When given and synced, pods are read from
+        its in-memory copy instead of being listed from the API server.
+    :param limit: Stop after finding this many pods. Later targets aren't looked up at all.
+    """
+    if namespace is None:
+        namespace = default_namespace()
+    if informer is not None and (informer.namespace != namespace or not informer.synced):
+        informer = None
+
+    pod_infos = (
+        TargetPodInfo(config_target=target, pod=pod)
+        for target in targets
+        for pod in target.iter_filter(
+            get_pods(service=target.service, namespace=namespace, informer=informer), namespace
+        )
+    )
+    return list(islice(pod_infos, limit))
+
+
+def get_pods(
+    *, namespace: str, service: Optional[str], informer: Optional[Informer] = None
+) -> List[V1Pod]:
+    if informer is not None:
+        pods = informer.snapshot()
+        if service:
+            selector = service_selector(namespace, service)
+            return [pod for pod in pods if has_labels(pod, selector)]
+        return list(pods)
+
     if service:
-        service = core_v1.read_namespaced_service(service, namespace)
-        selector = service.spec.selector
-        selector_str = ",".join([f"{k}={v}" for k, v in selector.items()])
-        return core_v1.list_namespaced_pod(namespace, label_selector=selector_str)
+        selector = service_selector(namespace, service)
+        selector_str = ",".join([f"{k}={v}" for k, v in selector])
+        return core_v1.list_namespaced_pod(namespace, label_selector=selector_str).items
     else:
-        return core_v1.list_namespaced_pod(namespace)
+        return core_v1.list_namespaced_pod(namespace).items
 
 
-def filter_pods(target: ConfigTarget, pods: Iterable[V1Pod], namespace: str) -> Iterable[V1Pod]:
-    return filter(lambda pod: target.matches(pod, namespace), pods.items)
+def has_labels(pod: V1Pod, labels: Iterable[Tuple[str, str]]) -> bool:
+    pod_labels = pod.metadata.labels or {}
+    return all(pod_labels.get(key) == value for key, value in labels)
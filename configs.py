@@ -1,45 +1,107 @@
-import datetime
-import logging
 import re
-from typing import List, Literal, Optional
+from functools import cached_property, lru_cache
+from typing import Callable, Iterable, Iterator, List, Literal, Optional, Tuple
 
 from kubernetes.client.models.v1_pod import V1Pod
-from pydantic import BaseModel, NonNegativeFloat, NonNegativeInt, PositiveInt
-
-from kube_client import core_v1
-
-
-class UTCFormatter(logging.Formatter):
-    def formatTime(self, record, datefmt=None):
-        # Get UTC time and format with milliseconds
-        utc_dt = datetime.datetime.utcfromtimestamp(record.created)
-        if datefmt:
-            s = utc_dt.strftime(datefmt)
-            # Add milliseconds
-            s = s + f".{int(record.msecs):03d}"
-            return s
-        else:
-            t = utc_dt.strftime("%Y-%m-%d %H:%M:%S")
-            s = f"{t}.{int(record.msecs):03d}"
-            return s
-
-
-logfmt = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
-datefmt = "%Y-%m-%d %H:%M:%S"
-
-handler = logging.StreamHandler()
-handler.setFormatter(UTCFormatter(logfmt, datefmt=datefmt))
-
-logging.basicConfig(level=logging.INFO, handlers=[handler])
-
-logger = logging.getLogger(__file__)
+from pydantic import BaseModel, ConfigDict, NonNegativeFloat, NonNegativeInt, PositiveInt
+
+from kube_client import service_selector
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@lru_cache(maxsize=4096)
+def _format_url(url: str, node: str, port: int) -> str:
+    return url.format(node=node, port=port)
+
+
+_REGEX_META = frozenset(".^$*+?{}[]\\|()")
+_INLINE_FLAGS_RE = re.compile(r"\(\?[aiLmsux-]")
+_CLASS_ESCAPES = frozenset("dDsSwWbBAZ")
+# What `re` accepts as a `{m,n}` quantifier. Any other `{` is a literal character.
+_QUANTIFIER_RE = re.compile(r"\{(?:\d+|\d*,\d*)\}")
+
+
+def _plain_template(pattern: str) -> Optional[Tuple[str, bool, bool]]:
+    """If `pattern` is plain text with optional `^`/`$` anchors,
+    return `(text, anchored_at_start, anchored_at_end)`. Otherwise return None."""
+    start = pattern.startswith("^")
+    text = pattern[1:] if start else pattern
+    end = text.endswith("$")
+    text = text[:-1] if end else text
+    if any(char in _REGEX_META for char in text):
+        return None
+    return text, start, end
+
+
+def _required_literal(pattern: str) -> str:
+    """Return the longest run of plain text that every match of `pattern` contains.
+
+    Only text outside of groups and not followed by a quantifier counts.
+    Returns "" whenever the pattern uses something this does not understand."""
+    if _INLINE_FLAGS_RE.search(pattern):
+        return ""
+    runs = [""]
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == "\\":
+            escaped = pattern[i : i + 1]
+            i += 1
+            if escaped in _CLASS_ESCAPES:
+                runs.append("")
+                continue
+            if not escaped or escaped.isalnum():
+                # Escapes like \x41 or \1 whose meaning would need a real parser.
+                return ""
+            char = escaped
+        elif char == "[":
+            if pattern[i : i + 1] == "^":
+                i += 1
+            if pattern[i : i + 1] == "]":
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            runs.append("")
+            continue
+        elif char in "()":
+            depth += 1 if char == "(" else -1
+            runs.append("")
+            continue
+        elif char == "|":
+            if depth == 0:
+                return ""
+            continue
+        elif char in "*?" or (char == "{" and _QUANTIFIER_RE.match(pattern, i - 1)):
+            # The preceding character may be absent, or repeated.
+            if depth == 0 and runs[-1]:
+                runs[-1] = runs[-1][:-1]
+            if char == "{":
+                i = _QUANTIFIER_RE.match(pattern, i - 1).end()
+            runs.append("")
+            continue
+        elif char in "+.^$":
+            runs.append("")
+            continue
+        if depth == 0:
+            runs[-1] += char
+    return max(runs, key=len)
 
 
 class ConfigEndpoint(BaseModel):
     """Describes an endpoint on a pod in the cluster.
     This endpoint may exist on multiple pods, or just a single pod, or no pod at all.
 
-    It is the responsibility of the caller to combine a defined endpoint with a proper pod."""
+    It is the responsibility of the caller to combine a defined endpoint with a proper pod.
+
+    Endpoints are frozen: they are shared between every request that uses them.
+    Use `model_copy(update=...)` to derive a modified endpoint."""
+
+    model_config = ConfigDict(frozen=True)
 
     name: str
     """The name of this config object."""
@@ -75,6 +137,16 @@ class ConfigEndpoint(BaseModel):
     paged: bool
     """Use `True` if the request returns paged data. Otherwise, use `False`."""
 
+    extract_path: Tuple[str, ...] = ()
+    """For paged endpoints, the keys leading to the items in each page.
+    Example: `["messages"]` collects `page["messages"]` from every page.
+    Lists met on the way are flattened. Default is the whole page."""
+
+    def format_url(self, node: str, port: int) -> str:
+        """Return `url` with `{node}` and `{port}` filled in.
+        Memoized, since the same endpoints are requested from the same pods over and over."""
+        return _format_url(self.url, node, port)
+
 
 class ConfigRequest(BaseModel):
     """A request to be made to a pod.
@@ -118,31 +190,92 @@ class ConfigTarget(BaseModel):
     """Port to use for requests to endpoints with this target.
     Default is 80."""
 
+    @cached_property
+    def _name_re(self) -> Optional[re.Pattern]:
+        """`name_template`, compiled once per target."""
+        return None if self.name_template is None else re.compile(self.name_template)
+
+    @cached_property
+    def _name_matcher(self) -> Optional[Callable[[str], bool]]:
+        """Check a pod name against `name_template` as cheaply as possible.
+
+        Plain-text templates are compared without the regex engine. Otherwise, names
+        that lack a literal every match must contain are rejected before the regex runs."""
+        if self.name_template is None:
+            return None
+
+        plain = _plain_template(self.name_template)
+        if plain is not None:
+            text, start, end = plain
+            if start and end:
+                return lambda name: name == text
+            if start:
+                return lambda name: name.startswith(text)
+            if end:
+                return lambda name: name.endswith(text)
+            return lambda name: text in name
+
+        search = self._name_re.search
+        literal = _required_literal(self.name_template)
+        if literal:
+            return lambda name: literal in name and search(name) is not None
+        return lambda name: search(name) is not None
+
+    def _compile_predicate(self, namespace: str) -> Callable[[V1Pod], bool]:
+        """Build the check behind `matches` and `filter` for pods of `namespace`.
+
+        The selector and name matcher are resolved here once, and checks whose field
+        is unset are left out of the returned function."""
+        stateful_set = self.stateful_set
+        name_matcher = self._name_matcher
+        selector = None if self.service is None else service_selector(namespace, self.service)
+
+        def owned(metadata, _stateful_set=stateful_set) -> bool:
+            owners = metadata.owner_references
+            return owners is not None and all(
+                owner.kind == "StatefulSet" and owner.name == _stateful_set for owner in owners
+            )
+
+        def labelled(metadata, _selector=selector) -> bool:
+            labels = metadata.labels or {}
+            return all(labels.get(key) == value for key, value in _selector)
+
+        checks = []
+        if stateful_set is not None:
+            checks.append(owned)
+        if name_matcher is not None:
+            checks.append(lambda metadata, _name_matcher=name_matcher: _name_matcher(metadata.name))
+        if selector is not None:
+            checks.append(labelled)
+
+        if not checks:
+            return lambda pod: True
+        if len(checks) == 1:
+            (check,) = checks
+            return lambda pod, _check=check: _check(pod.metadata)
+        if len(checks) == 2:
+            first, second = checks
+            return lambda pod, _first=first, _second=second: (
+                _first(pod.metadata) and _second(pod.metadata)
+            )
+        first, second, third = checks
+        return lambda pod, _first=first, _second=second, _third=third: (
+            _first(pod.metadata) and _second(pod.metadata) and _third(pod.metadata)
+        )
+
     def matches(self, pod: V1Pod, namespace: str) -> bool:
         """Check if pod is a valid target of self"""
+        return self._compile_predicate(namespace)(pod)
+
+    def filter(self, pods: Iterable[V1Pod], namespace: str) -> List[V1Pod]:
+        """Return the pods that are valid targets of self.
+
+        Same check as `matches`, compiled once for all pods instead of once per pod."""
+        return list(self.iter_filter(pods, namespace))
 
-        if self.stateful_set is not None:
-            if pod.metadata.owner_references is None:
-                return False
-            if not all(
-                [
-                    owner.kind == "StatefulSet" and owner.name == self.stateful_set
-                    for owner in pod.metadata.owner_references
-                ]
-            ):
-                return False
-
-        if self.name_template is not None:
-            if not re.search(self.name_template, pod.metadata.name):
-                return False
-
-        if self.service is not None:
-            service = core_v1.read_namespaced_service(self.service, namespace)
-            selector = service.spec.selector
-            if not all([pod.metadata.labels.get(key) == value for key, value in selector.items()]):
-                return False
-
-        return True
+    def iter_filter(self, pods: Iterable[V1Pod], namespace: str) -> Iterator[V1Pod]:
+        """Lazy version of `filter`, for callers that may stop early."""
+        return filter(self._compile_predicate(namespace), pods)
 
 
 class ConfigAction(BaseModel):
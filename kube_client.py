@@ -1,4 +1,172 @@
-from kubernetes import client, config
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from kubernetes import client, config, watch
+from kubernetes.client.exceptions import ApiException
+
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+NAMESPACE_FILE = "/var/run/secrets/kubernetes.io/serviceaccount/namespace"
 
 config.load_incluster_config()
 core_v1 = client.CoreV1Api()
+
+
+@lru_cache(maxsize=1)
+def default_namespace() -> str:
+    """The namespace this pod runs in. Read once from the service account mount."""
+    try:
+        with open(NAMESPACE_FILE) as file:
+            return file.read().strip() or "default"
+    except FileNotFoundError:
+        return "default"
+
+
+service_informers: Dict[str, "Informer"] = {}
+"""Service informers by namespace. While one is synced, `service_selector` reads from it."""
+
+
+def service_selector(namespace: str, service: str) -> Tuple[Tuple[str, str], ...]:
+    """The label selector of a service, as sorted `(key, value)` pairs."""
+    informer = service_informers.get(namespace)
+    if informer is not None and informer.synced:
+        obj = informer.get(service)
+        if obj is not None:
+            return _selector_pairs(obj)
+    return _read_service_selector(namespace, service)
+
+
+@lru_cache(maxsize=128)
+def _read_service_selector(namespace: str, service: str) -> Tuple[Tuple[str, str], ...]:
+    """Cached, since selectors rarely change. See `clear_caches`."""
+    return _selector_pairs(core_v1.read_namespaced_service(service, namespace))
+
+
+def _selector_pairs(service) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(service.spec.selector.items()))
+
+
+def clear_caches():
+    """Forget cached lookups, so the next ones go to the API server."""
+    _read_service_selector.cache_clear()
+
+
+class Informer:
+    """Keeps an in-memory copy of the objects in a namespace, updated by a watch stream
+    running in a background thread, so lookups don't need a round-trip to the API server.
+
+    `list_func` is a namespaced list call, such as `core_v1.list_namespaced_pod`.
+    """
+
+    retry_delay: float = 1.0
+    """Seconds to wait before listing again after the watch fails."""
+
+    watch_timeout: int = 30
+    """Seconds each watch request lasts before it is renewed.
+    Bounds how long `resync` and `stop` take to be noticed."""
+
+    def __init__(self, list_func: Callable, namespace: str):
+        self.list_func = list_func
+        self.namespace = namespace
+        self._objects: Dict[str, Any] = {}
+        self._snapshot: Tuple[Any, ...] = ()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._resync = threading.Event()
+        self._watch: Optional[watch.Watch] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def synced(self) -> bool:
+        """True once the initial list has been loaded."""
+        return self._synced.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=f"informer-{self.list_func.__name__}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def resync(self):
+        """Have the informer thread list the objects again from scratch, replacing the
+        in-memory copy. Returns right away: the current copy is served until the list is done."""
+        self._resync.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def snapshot(self) -> Tuple[Any, ...]:
+        """The objects currently known, as an immutable tuple."""
+        if self._dirty:
+            with self._lock:
+                if self._dirty:
+                    self._snapshot = tuple(self._objects.values())
+                    self._dirty = False
+        return self._snapshot
+
+    def get(self, name: str) -> Optional[Any]:
+        return self._objects.get(name)
+
+    def _replace(self, objects: List[Any]):
+        with self._lock:
+            self._objects = {obj.metadata.name: obj for obj in objects}
+            self._snapshot = tuple(self._objects.values())
+            self._dirty = False
+        self._synced.set()
+
+    def _apply(self, event: dict):
+        obj = event["object"]
+        with self._lock:
+            if event["type"] == "DELETED":
+                self._objects.pop(obj.metadata.name, None)
+            else:
+                self._objects[obj.metadata.name] = obj
+            # The tuple is rebuilt by the next `snapshot`, not once per event.
+            self._dirty = True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._resync.clear()
+                objects = self.list_func(self.namespace)
+                self._replace(objects.items)
+                self._watch_from(objects.metadata.resource_version)
+            except Exception as e:
+                logger.error(
+                    "Informer watch failed. list_func: `%s` namespace: `%s` exception: `%r`",
+                    self.list_func.__name__,
+                    self.namespace,
+                    e,
+                )
+                self._stopped.wait(self.retry_delay)
+
+    def _watch_from(self, resource_version: str):
+        """Apply watch events until stopped, or until the objects must be listed again.
+
+        Events are only applied by this thread, after the list they follow, so a resync
+        can't be overwritten by events from before it."""
+        while not (self._stopped.is_set() or self._resync.is_set()):
+            self._watch = watch.Watch()
+            try:
+                for event in self._watch.stream(
+                    self.list_func,
+                    self.namespace,
+                    resource_version=resource_version,
+                    timeout_seconds=self.watch_timeout,
+                ):
+                    self._apply(event)
+            except ApiException as e:
+                if e.status == 410:
+                    # Too old to watch from: list again.
+                    return
+                raise
+            resource_version = self._watch.resource_version
@@ -1,18 +1,12 @@
-import traceback
-from functools import wraps
-from typing import Annotated, Callable, Literal, ParamSpec, TypeVar, Union
+from typing import Annotated, Literal, Union
 
-from fastapi import HTTPException
 from pydantic import BaseModel, Field
 
 from configs import ConfigEndpoint, ConfigTarget
 from schemas import NotFoundError
 from utils import setup_logger
 
-logger = setup_logger(__file__)
-
-P = ParamSpec("P")
-R = TypeVar("R")
+logger = setup_logger(__name__)
 
 
 def unwrap_arg(arg, key, config):
@@ -27,21 +21,6 @@ def unwrap_arg(arg, key, config):
         return arg.value
 
 
-def endpoint_error_handler(func: Callable[P, R]) -> Callable[P, R]:
-    @wraps(func)
-    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-        try:
-            return func(*args, **kwargs)
-        except HTTPException:
-            raise
-        except Exception as e:
-            message = f"{e!r}\n{traceback.format_exc()}"
-            logger.error(message)
-            raise HTTPException(status_code=500, detail=message) from e
-
-    return wrapper
-
-
 class TargetConfig(BaseModel):
     kind: Literal["config"]
     value: ConfigTarget
@@ -62,6 +41,13 @@ class EndpointName(BaseModel):
     value: str
 
 
+TargetArg = Annotated[Union[TargetName, TargetConfig], Field(discriminator="kind")]
+"""A target given either by its name in the config, or as a full `ConfigTarget`."""
+
+EndpointArg = Annotated[Union[EndpointName, EndpointConfig], Field(discriminator="kind")]
+"""An endpoint given either by its name in the config, or as a full `ConfigEndpoint`."""
+
+
 class InvokeRequestData(BaseModel):
-    target: Annotated[Union[TargetName, TargetConfig], Field(discriminator="kind")]
-    endpoint: Annotated[Union[EndpointName, EndpointConfig], Field(discriminator="kind")]
+    target: TargetArg
+    endpoint: EndpointArg
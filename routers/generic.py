@@ -2,55 +2,76 @@ from typing import Awaitable, Callable
 
 from fastapi import APIRouter, Depends, Request
 
-from common import call_endpoint, get_pod_infos
-from configs import ConfigRequest
-from routers.deps import InvokeRequestData, endpoint_error_handler, unwrap_arg
+from common import (
+    call_endpoint_async,
+    do_action_async,
+    get_pod_infos,
+    group_pods_by_target,
+    select_action_pods,
+)
+from kube_client import clear_caches
+from routers.deps import InvokeRequestData, unwrap_arg
 from schemas import NotFoundError
 from utils import setup_logger
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
 
 
 def create_router(get_config: Callable[[], Awaitable[dict]]) -> APIRouter:
     router = APIRouter()
 
     @router.post("/process")
-    @endpoint_error_handler
     async def process_data(
         request: Request,
         data: InvokeRequestData,
         config=Depends(get_config),
     ):
-        logger.info(f"/process. request: `{request}` data: `{data}`")
+        logger.info("/process. request: `%s` data: `%s`", request, data)
         target = unwrap_arg(data.target, "targets", config)
         endpoint = unwrap_arg(data.endpoint, "endpoints", config)
 
-        configRequest = ConfigRequest(
-            name="dummy_request",
-            endpoint=endpoint,
-            retries=0,
-            retry_delay=0,
+        pods = get_pod_infos(
+            targets=[target],
+            namespace=request.app.state.namespace,
+            informer=request.app.state.pod_informer,
+            limit=1,
         )
-        try:
-            pods = get_pod_infos(
-                targets=[target],
-                namespace=request.app.state.namespace,
-                cache=request.app.state.cache,
-            )
-            pod_info = next(iter(pods))
-        except StopIteration as e:
-            raise NotFoundError(f"Target not found. Target: {target}") from e
-
-        result = call_endpoint(configRequest.endpoint, pod_info)
+        if not pods:
+            raise NotFoundError(f"Target not found. Target: {target}")
+        pod_info = pods[0]
+
+        result = await call_endpoint_async(endpoint, pod_info, request.app.state.http_client)
         return result
 
+    @router.post("/action/{name}")
+    async def run_action(
+        request: Request,
+        name: str,
+        config=Depends(get_config),
+    ):
+        logger.info("/action. request: `%s` name: `%s`", request, name)
+        try:
+            action = config["actions"][name]
+        except KeyError as e:
+            raise NotFoundError(f"Action not found. Action: `{name}`") from e
+
+        pods = get_pod_infos(
+            targets=list({target.name: target for target in action.targets}.values()),
+            namespace=request.app.state.namespace,
+            informer=request.app.state.pod_informer,
+        )
+        pods = select_action_pods(action, group_pods_by_target(pods))
+        results = await do_action_async(action, pods, request.app.state.http_client)
+        return {"action": name, "results": results}
+
     @router.post("/cache/clear")
-    @endpoint_error_handler
     async def process_data(
         request: Request,
         config=Depends(get_config),
     ):
-        request.app.state.cache.clear()
+        clear_caches()
+        request.app.state.pod_informer.resync()
+        request.app.state.service_informer.resync()
         return {"cleared": True}
 
     return router
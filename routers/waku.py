@@ -1,18 +1,18 @@
 import base64
 import os
 import urllib
-from typing import Annotated, Awaitable, Callable, Union
+from typing import Awaitable, Callable
 
 from fastapi import APIRouter, Depends, Request
-from pydantic import BaseModel, Field, NonNegativeInt
+from pydantic import BaseModel, NonNegativeInt
 
-from common import call_endpoint, get_pod_infos
+from common import call_endpoint_async, get_pod_infos
 from configs import ConfigEndpoint
-from routers.deps import TargetConfig, TargetName, endpoint_error_handler, unwrap_arg
+from routers.deps import TargetArg, unwrap_arg
 from schemas import NotFoundError, TargetPodInfo
 from utils import redact_keys, setup_logger
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
 
 
 def get_endpoint_relay_v1(
@@ -42,7 +42,7 @@ def get_endpoint_relay_v1(
 
 
 class WakuRequestData(BaseModel):
-    target: Annotated[Union[TargetName, TargetConfig], Field(discriminator="kind")]
+    target: TargetArg
     content_topic: str
     cluster_id: int
     port: NonNegativeInt
@@ -53,7 +53,6 @@ def create_router(get_config: Callable[[], Awaitable[dict]]) -> APIRouter:
     router = APIRouter()
 
     @router.post("/waku/relay")
-    @endpoint_error_handler
     async def waku(
         request: Request,
         data: WakuRequestData,
@@ -61,15 +60,15 @@ def create_router(get_config: Callable[[], Awaitable[dict]]) -> APIRouter:
     ):
         target = unwrap_arg(data.target, "targets", config)
 
-        try:
-            pods = get_pod_infos(
-                targets=[target],
-                namespace=request.app.state.namespace,
-                cache=request.app.state.cache,
-            )
-            pod_info = next(iter(pods))
-        except StopIteration as e:
-            raise NotFoundError(f"Target not found. Target: {target}") from e
+        pods = get_pod_infos(
+            targets=[target],
+            namespace=request.app.state.namespace,
+            informer=request.app.state.pod_informer,
+            limit=1,
+        )
+        if not pods:
+            raise NotFoundError(f"Target not found. Target: {target}")
+        pod_info = pods[0]
 
         endpoint = get_endpoint_relay_v1(
             content_topic=data.content_topic,
@@ -78,11 +77,13 @@ def create_router(get_config: Callable[[], Awaitable[dict]]) -> APIRouter:
             msg_size_kbytes=data.msg_size_kbytes,
             node_info=pod_info,
         )
-        result = call_endpoint(endpoint, pod_info)
+        result = await call_endpoint_async(endpoint, pod_info, request.app.state.http_client)
         # Remove values for "payload", since it is a large amount of generated bytes.
         result = redact_keys(result, keys_to_redact=("payload",))
         configEndpoint = result["request"]["configEndpoint"]
-        configEndpoint.params = redact_keys(configEndpoint.params, keys_to_redact=("payload",))
+        result["request"]["configEndpoint"] = configEndpoint.model_copy(
+            update={"params": redact_keys(configEndpoint.params, keys_to_redact=("payload",))}
+        )
         return result
 
     return router
@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+import kubernetes.config
+
+# The modules are imported from the repository root, as the app runs them.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# `kube_client` loads the in-cluster config at import. Outside a cluster there is none to load.
+kubernetes.config.load_incluster_config = lambda *args, **kwargs: None
@@ -0,0 +1,60 @@
+import random
+import re
+import warnings
+
+import pytest
+
+from configs import ConfigTarget, _required_literal
+
+
+def name_matcher(pattern: str):
+    return ConfigTarget(name="target", name_template=pattern)._name_matcher
+
+
+@pytest.mark.parametrize(
+    "pattern, name",
+    [
+        ("{|^}b", "{}"),
+        ("a{|b", "b"),
+        ("a{}b", "a{}b"),
+        ("a{x}b", "a{x}b"),
+        ("a{1,x}b", "a{1,x}b"),
+        ("ab{2}c", "abbc"),
+        ("ab{,2}c", "ac"),
+        ("ab{1,}c", "abbbc"),
+        ("ab{,}c", "ac"),
+        ("x{1,2}|y", "y"),
+        ("^client-0-[0-9]+$", "client-0-12"),
+        ("client-(0|1)-2", "client-1-2"),
+    ],
+)
+def test_name_matcher_matches_like_re_search(pattern, name):
+    assert re.search(pattern, name) is not None
+    assert name_matcher(pattern)(name)
+
+
+def test_required_literal_treats_invalid_quantifiers_as_text():
+    assert _required_literal("{|^}b") == ""
+    assert _required_literal("pod{x}-") == "pod{x}-"
+    assert _required_literal("pod-{2}") == "pod"
+
+
+def test_name_matcher_agrees_with_re_search_on_random_patterns():
+    rng = random.Random(0)
+    pattern_chars = "ab{}|^$,12()*+?.[]\\-"
+    name_chars = "ab{}|,12-"
+    checked = 0
+    for _ in range(20000):
+        pattern = "".join(rng.choices(pattern_chars, k=rng.randint(1, 8)))
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", FutureWarning)
+                compiled = re.compile(pattern)
+        except re.error:
+            continue
+        matcher = name_matcher(pattern)
+        for _ in range(8):
+            name = "".join(rng.choices(name_chars, k=rng.randint(0, 6)))
+            assert matcher(name) == (compiled.search(name) is not None), (pattern, name)
+            checked += 1
+    assert checked > 10000
@@ -1,43 +1,103 @@
-import datetime
+import asyncio
+import json
 import logging
+import random
 import socket
+import threading
 import time
 import traceback
+from itertools import chain
 from pathlib import Path
 from typing import Any, Collection, Dict, List, Tuple
 
-import requests
+import httpx
+from cachetools import TTLCache, cached
 from pydantic import BaseModel, Field, PositiveInt
 
 LOGFMT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
 DATEFMT = "%Y-%m-%d %H:%M:%S"
 
+HTTP_TIMEOUT = 30.0
+"""Seconds to wait on any single request to a pod."""
+
+DNS_CACHE_TTL = 30
+"""Seconds a DNS resolution is reused before looking the name up again."""
+
 
 class UTCFormatter(logging.Formatter):
     """Formatter that outputs UTC timestamps with milliseconds."""
 
     def formatTime(self, record, datefmt=None):
-        dt = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
-        if datefmt is None:
-            datefmt = DATEFMT
-        base = dt.strftime(datefmt)
-        return f"{base}.{int(record.msecs):03d}"
+        tm = time.gmtime(record.created)
+        if datefmt is None or datefmt == DATEFMT:
+            return "%04d-%02d-%02d %02d:%02d:%02d.%03d" % (
+                tm.tm_year,
+                tm.tm_mon,
+                tm.tm_mday,
+                tm.tm_hour,
+                tm.tm_min,
+                tm.tm_sec,
+                int(record.msecs),
+            )
+        return f"{time.strftime(datefmt, tm)}.{int(record.msecs):03d}"
 
 
-def setup_logger(name: str) -> logging.Logger:
+_logging_configured = False
+
+
+def _configure_logging_once():
+    global _logging_configured
+    if _logging_configured:
+        return
     handler = logging.StreamHandler()
     handler.setFormatter(UTCFormatter(LOGFMT, datefmt=DATEFMT))
 
     logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
+    _logging_configured = True
+
+
+def setup_logger(name: str) -> logging.Logger:
+    """Logger for a module. Pass `__name__`. The root handler is installed by the first call."""
+    _configure_logging_once()
     return logging.getLogger(name)
 
 
-logger = setup_logger(__file__)
+logger = setup_logger(__name__)
+
+
+@cached(TTLCache(maxsize=4096, ttl=DNS_CACHE_TTL), lock=threading.Lock())
+def gethostbyname_ex(hostname: str) -> Tuple[str, List[str], List[str]]:
+    """`socket.gethostbyname_ex`, cached for `DNS_CACHE_TTL` seconds per hostname."""
+    return socket.gethostbyname_ex(hostname)
+
+
+@cached(TTLCache(maxsize=4096, ttl=DNS_CACHE_TTL), lock=threading.Lock())
+def gethostbyaddr(ip_address: str) -> Tuple[str, List[str], List[str]]:
+    """`socket.gethostbyaddr`, cached for `DNS_CACHE_TTL` seconds per address.
+    For callers that need the PTR name of an address, which `resolve_dns` doesn't look up."""
+    return socket.gethostbyaddr(ip_address)
+
+
+async def resolve_many_async(hostnames: List[str]) -> List[Any]:
+    """
+    Resolve every hostname concurrently in the loop's default executor.
+
+    :return: `gethostbyname_ex` result for each hostname, or the exception raised resolving it.
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(loop.run_in_executor(None, gethostbyname_ex, hostname) for hostname in hostnames),
+        return_exceptions=True,
+    )
+
+
+def resolve_many(hostnames: List[str]) -> List[Any]:
+    return asyncio.run(resolve_many_async(hostnames))
 
 
 def get_ips_by_service(service: str) -> List[str]:
     try:
-        _, _, ips = socket.gethostbyname_ex(service)
+        _, _, ips = gethostbyname_ex(service)
         return ips[0]
     except Exception as e:
         error = traceback.format_exc()
@@ -121,18 +181,30 @@ def get_ips_by_type(args: dict, *, namespace=None) -> List[Tuple[str, str]]:
     """
     # TODO: Handle multiple shards.
 
-    results = []
+    start_index = args.get("start_index", 0)
+    # Look up each service once, even if several node types share it.
+    all_services = list(
+        dict.fromkeys(
+            node_type.service for node_type in node_types if args[node_type.count_key] == "all"
+        )
+    )
+    service_ip_counts = {}
+    for service, resolved in zip(all_services, resolve_many(all_services)):
+        if isinstance(resolved, socket.gaierror):
+            # This happens when either:
+            # 1. The service doesn't exist.
+            # 2. No pods with the matching app selector exist, thus though the service exists, it isn't running on any pod.
+            service_ip_counts[service] = 0
+        elif isinstance(resolved, Exception):
+            raise resolved
+        else:
+            _, _, ip_list = resolved
+            service_ip_counts[service] = len(ip_list)
+
+    nodes = []
     for node_type in node_types:
-        start_index = args.get("start_index", 0)
         if args[node_type.count_key] == "all":
-            try:
-                _, _, ip_list = socket.gethostbyname_ex(node_type.service)
-                count = len(ip_list) - start_index
-            except socket.gaierror:
-                # This happens when either:
-                # 1. The service doesn't exist.
-                # 2. No pods with the matching app selector exist, thus though the service exists, it isn't running on any pod.
-                count = 0
+            count = max(service_ip_counts[node_type.service] - start_index, 0)
             # TODO: Check at the end if all `count` ips have been found.
             # TODO: Add "unknown-{index}" for ips not in {nodetype}-0-{index}
             # Note that if node types share the same service, count will be set to the total.
@@ -147,16 +219,20 @@ def get_ips_by_type(args: dict, *, namespace=None) -> List[Tuple[str, str]]:
         logger.info(
             f"Getting {count} IPs from nodes of type `{node_type.name_template}` starting at index {start_index}"
         )
-        for index in range(start_index, start_index + count):
-            dns = node_type.dns_name(index)
-            try:
-                _, _, ips = socket.gethostbyname_ex(dns)
-                results.append((node_type.get_node_name(index), ips[0]))
-            except Exception as e:
-                error = traceback.format_exc()
-                logger.error(
-                    f"Failed to resolve dns. dns: `{dns}`, node_type: `{node_type}`, exception: `{e}`, error: {error}"
-                )
+        nodes.extend((node_type, index) for index in range(start_index, start_index + count))
+
+    # Resolve the nodes of every type in one concurrent batch.
+    dns_names = [node_type.dns_name(index) for node_type, index in nodes]
+    results = []
+    for (node_type, index), dns, resolved in zip(nodes, dns_names, resolve_many(dns_names)):
+        if isinstance(resolved, Exception):
+            error = "".join(traceback.format_exception(resolved))
+            logger.error(
+                f"Failed to resolve dns. dns: `{dns}`, node_type: `{node_type}`, exception: `{resolved}`, error: {error}"
+            )
+            continue
+        _, _, ips = resolved
+        results.append((node_type.get_node_name(index), ips[0]))
 
     return results
 
@@ -164,14 +240,14 @@ def get_ips_by_type(args: dict, *, namespace=None) -> List[Tuple[str, str]]:
 def resolve_dns(node: str) -> Tuple[str, str]:
     start_time = time.time()
     name, port = node.split(":")
-    ip_address = socket.gethostbyname(name)
-    entire_hostname = socket.gethostbyaddr(ip_address)
-    hostname = entire_hostname[0].split(".")[0]
+    _, _, ips = gethostbyname_ex(name)
+    ip_address = ips[0]
+    hostname = name.split(".")[0]
     elapsed = (time.time() - start_time) * 1000
     logger.info(f"{node} DNS Response took {elapsed} ms")
     logger.info(f"Talking with {hostname}, ip address: {ip_address}")
 
-    return (entire_hostname, f"{ip_address}:{port}")
+    return (hostname, f"{ip_address}:{port}")
 
 
 def get_ips(args) -> Tuple[str, str]:
@@ -185,35 +261,38 @@ def get_ips(args) -> Tuple[str, str]:
         return [resolve_dns(service)]
 
 
-# TODO: Extraneous code? (unused)
-def get_api_args(args_dict: dict) -> dict:
-    """These are the arguments that should be passed on to the GET request for store messages."""
-    return {
-        key: value
-        for key, value in args_dict.items()
-        if key
-        in [
-            "contentTopics",
-            "pubsubTopic",
-            "pageSize",
-            "cursor",
-        ]
-    }
-
-
-def dict_extract(obj: dict, path: Path):
-    def extract(obj: Any, parts: list, is_list=False):
+def dict_extract(obj: dict, path: Path | Tuple[str, ...]):
+    """Follow the keys of `path` into `obj`. Lists met on the way are flattened, with the
+    rest of the path applied to each item, in which case a flat list of results is returned."""
+    parts = path.parts if isinstance(path, Path) else path
+    for depth, key in enumerate(parts):
         if isinstance(obj, list):
-            results = []
-            for item in obj:
-                results.extend(extract(item, parts, is_list=True))
-            return results
-        if not parts:
-            return [obj] if is_list else obj
-        next_obj = obj[parts[0]]
-        return extract(next_obj, parts[1:], is_list)
-
-    return extract(obj, path.parts)
+            break
+        obj = obj[key]
+    else:
+        depth = len(parts)
+        if not isinstance(obj, list):
+            return obj
+
+    level = _flatten(obj)
+    for key in parts[depth:]:
+        level = _flatten([item[key] for item in level])
+    return level
+
+
+def _flatten(items: list) -> list:
+    """Flatten nested lists in order, without recursion."""
+    flat = []
+    stack = [iter(items)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, list):
+                stack.append(iter(item))
+                break
+            flat.append(item)
+        else:
+            stack.pop()
+    return flat
 
 
 def next_cursor(data: Dict) -> str | None:
@@ -226,69 +305,97 @@ def next_cursor(data: Dict) -> str | None:
 
 
 def paged_request(request: dict, max_attempts: PositiveInt, page_request_delay: float) -> dict:
+    """Blocking version of `paged_request_async`, for callers without an event loop."""
+
+    async def run() -> dict:
+        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
+            return await paged_request_async(client, request, max_attempts, page_request_delay)
+
+    return asyncio.run(run())
+
+
+async def paged_request_async(
+    client: httpx.AsyncClient,
+    request: dict,
+    max_attempts: PositiveInt,
+    page_request_delay: float,
+) -> dict:
     """
     GET request with a "paged" param.
 
+    :param client: Client to make the requests with. Its connections are reused across pages.
     :param request: Must contain "params":dict.
+    :param page_request_delay: Seconds to wait before requesting the next page. Failed attempts
+        are retried after `page_request_delay * 2**(attempt - 1)`, with jitter.
     """
     attempt_num = 1
 
     url = request["url"]
-    all_messages = []
+    pages_messages = []
     pages_data = []
-    params = request["params"]
+    # Copied, so the cursor isn't written into the caller's params.
+    params = dict(request["params"])
     status_codes = []
     inner_status_codes = []
+    delay = 0.0
     while True:
-        time.sleep(page_request_delay)
+        if delay:
+            await asyncio.sleep(delay)
 
-        logger.info(f"Making paged request. request: `{request}`, params=`{params}`")
-        response = requests.get(url, headers=request["headers"], params=params)
+        logger.info("Making paged request. request: `%s`, params=`%s`", request, params)
+        response = await client.get(url, headers=request["headers"], params=params)
 
         try:
             data = response.json()
-        except requests.exceptions.JSONDecodeError:
+        except json.JSONDecodeError:
             data = response.text
 
         status_codes.append(response.status_code)
         pages_data.append(data)
 
-        logger.info(f"response to paged request: `{response}`")
+        logger.info("response to paged request: `%s`", response)
         if response.status_code != 200:
             logger.error(
-                f"Error fetching paged data. status_code: `{response.status_code}` data: `{data}`"
+                "Error fetching paged data. status_code: `%s` data: `%s`",
+                response.status_code,
+                data,
             )
             break
 
         inner_status_codes.append(data["statusCode"])
-        logger.info(f"Response data: `{data}`")
+        logger.info("Response data: `%s`", data)
 
         if data["statusCode"] != 200:
             logger.info(
-                f"inner_status_code != 200: status_code: `{data['statusCode']}`, attempt: `{attempt_num}`"
+                "inner_status_code != 200: status_code: `%s`, attempt: `%s`",
+                data["statusCode"],
+                attempt_num,
             )
 
             if attempt_num >= max_attempts:
-                logger.info(f"Exhausted all attempts: `{attempt_num}`")
+                logger.info("Exhausted all attempts: `%s`", attempt_num)
                 break
+            # Jittered, so retries against many pods don't line up.
+            delay = page_request_delay * 2 ** (attempt_num - 1) * random.uniform(0.5, 1.5)
             attempt_num += 1
             continue
 
-        logger.info(f"inner_status_code == 200: attempt: `{attempt_num}`")
+        logger.info("inner_status_code == 200: attempt: `%s`", attempt_num)
         if attempt_num > 1:
             logger.info("A previous attempt failed, but now it worked.")
 
-        paged_data = dict_extract(data, request.get("extract_keys", Path()))
-        logger.info(f"Retrieved {len(paged_data)} messages on attempt `{attempt_num}`")
-        all_messages.extend(paged_data)
+        paged_data = dict_extract(data, request.get("extract_keys", ()))
+        logger.info("Retrieved %s messages on attempt `%s`", len(paged_data), attempt_num)
+        pages_messages.append(paged_data)
 
         cursor = next_cursor(data)
         if not cursor:
-            logger.info(f"page request finished with !cursor on attempt `{attempt_num}`")
+            logger.info("page request finished with !cursor on attempt `%s`", attempt_num)
             break
         params["cursor"] = cursor
 
         attempt_num = 1
+        delay = page_request_delay
 
     logger.info("finished page request")
     return {
@@ -296,7 +403,7 @@ def paged_request(request: dict, max_attempts: PositiveInt, page_request_delay:
         "response": {
             "statusCodes": status_codes,
             "inner_statusCodes": inner_status_codes,
-            "messages": all_messages,
+            "messages": list(chain.from_iterable(pages_messages)),
             "pages": pages_data,
             "attempt_num": attempt_num,
         },
@@ -309,21 +416,66 @@ def redact_keys(
     replacement: Any = "<redacted>",
 ):
     """
-    Return a copy of `obj` where any dict entry whose key is in keys_to_redact
+    Return `obj` where any dict entry whose key is in keys_to_redact
     has its value replaced with `replacement`, recursively through dicts and
     lists/tuples.
+
+    Only the containers on the way to a redacted entry are copied. Everything else,
+    including `obj` itself when nothing needs redacting, is shared with the input.
     """
-    if isinstance(obj, dict):
-        new_dict = {}
-        for key, value in obj.items():
-            if key in keys_to_redact:
-                new_dict[key] = replacement
-            else:
-                new_dict[key] = redact_keys(value, keys_to_redact, replacement)
-        return new_dict
-    elif isinstance(obj, list):
-        return [redact_keys(item, keys_to_redact, replacement) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(redact_keys(item, keys_to_redact, replacement) for item in obj)
-    else:
+    keys = frozenset(keys_to_redact)
+    if not _contains_any(obj, keys):
         return obj
+
+    result = obj
+    # Frames are [container, key in parent, remaining entries, new entries, changed].
+    stack = [[obj, None, _entries(obj), [], False]]
+    while stack:
+        frame = stack[-1]
+        container, _, entries, new_entries, _ = frame
+        is_dict = isinstance(container, dict)
+        for key, value in entries:
+            if is_dict and key in keys:
+                new_entries.append((key, replacement))
+                frame[4] = True
+            elif isinstance(value, (dict, list, tuple)):
+                stack.append([value, key, _entries(value), [], False])
+                break
+            else:
+                new_entries.append((key, value))
+        else:
+            stack.pop()
+            _, key, _, new_entries, changed = frame
+            if changed:
+                if is_dict:
+                    new = dict(new_entries)
+                elif isinstance(container, list):
+                    new = [value for _, value in new_entries]
+                else:
+                    new = tuple(value for _, value in new_entries)
+            else:
+                new = container
+            if stack:
+                stack[-1][3].append((key, new))
+                stack[-1][4] = stack[-1][4] or changed
+            else:
+                result = new
+    return result
+
+
+def _entries(container: Any):
+    return iter(container.items()) if isinstance(container, dict) else enumerate(container)
+
+
+def _contains_any(obj: Any, keys: frozenset) -> bool:
+    """Whether any dict within `obj` has a key in `keys`."""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            if not keys.isdisjoint(obj):
+                return True
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return False